@@ -6,69 +6,238 @@ detects top-level third-party imports (non-stdlib), and generates a
 requirements.txt file listing them.
 """
 
-import ast
-import importlib.metadata
+import hashlib
+import heapq
 import json
 import logging
 import os
-import socket
+import re
+import stat
 import sys
 import time
 from collections.abc import Mapping
-from datetime import datetime
 from pathlib import Path
-from typing import Sequence
 
 logger = logging.getLogger(__name__)
 
 __version__ = "1.0.2"
 
-
-def resolve_distribution(import_name: str, import_to_dist: Mapping[str, Sequence[str]]) -> str:
+STDLIB_MODULES: frozenset[str] = frozenset(sys.stdlib_module_names)
+
+AST_CACHE_DIR = Path("logs") / "ast_cache"
+AST_CACHE_VERSION = 7  # Bump when extract_import_names changes what it returns
+
+# Both patterns below expect "\n"-only source; extract_import_names normalizes it.
+# Matches module-level "import a, b as c" and "from a.b import ..." lines
+IMPORT_RE = re.compile(
+    r"^(?:import[ \t]+(\w[\w.]*(?:[ \t]+as[ \t]+\w+)?(?:[ \t]*,[ \t]*\w[\w.]*(?:[ \t]+as[ \t]+\w+)?)*)"
+    r"|from[ \t]+(\w[\w.]*)[ \t]+import\b)",
+    re.MULTILINE,
+)
+# Sources the line scanner can't be trusted on: triple-quoted strings (which
+# may hold column-0 import text), indented imports (inside any block),
+# imports after a ":" or sharing a line with ";", and backslash continuations
+NEEDS_AST_RE = re.compile(
+    r"\"{3}|'{3}"
+    r"|^[ \t]+(?:import|from)[ \t]"
+    r"|^[^\n]*[:;][^\n]*\b(?:import|from)\b"
+    r"|^[^\n]*\b(?:import|from)\b[^\n]*;"
+    r"|\\$",
+    re.MULTILINE,
+)
+
+
+def extract_import_names(source: str) -> set[str]:
     """
-    Resolve a top-level import name to its PyPI distribution name.
-    Falls back to the import name if unresolved.
+    Return the top-level module names imported at module level in the given source.
+    Uses a line scanner only for sources made up of plain module-level import
+    lines, falling back to a full parse for anything else.
     """
-    dists = import_to_dist.get(import_name)
-    if dists and dists[0] != import_name:
-        logger.debug(f"Resolved {import_name} to {dists[0]}")
-        return dists[0]
-    return import_name
+    # The scanner's patterns assume "\n" line endings
+    if "\r" in source:
+        source = source.replace("\r\n", "\n").replace("\r", "\n")
+
+    if NEEDS_AST_RE.search(source):
+        return parse_import_names(source)
+
+    import_names: set[str] = set()
+    for match in IMPORT_RE.finditer(source):
+        if match.group(1):
+            for alias in match.group(1).split(","):
+                import_names.add(alias.split()[0].partition(".")[0])
+        else:
+            import_names.add(match.group(2).partition(".")[0])
 
+    return import_names
 
-def find_third_party_imports(file_path: str | Path) -> set[str]:
+
+def parse_import_names(source: str) -> set[str]:
     """
-    Return PyPI distribution names for top-level third-party imports
-    using installed package metadata.
+    Return the top-level module names imported at module level in the given source.
+    Imports nested in module-level if/for/while/try/with/match blocks are
+    included; imports local to functions and classes are skipped.
     """
-    path = Path(file_path)
-    if not path.is_file():
-        raise FileNotFoundError(f"File not found: {file_path}")
+    import ast  # Only needed when the line scanner falls back
 
-    source = path.read_text(encoding="utf-8")
     tree = ast.parse(source)
-
-    stdlib = sys.stdlib_module_names
-    import_to_dist = importlib.metadata.packages_distributions()
-    third_party: set[str] = set()
-
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Import):
+    import_names: set[str] = set()
+
+    # AST node classes are leaf types, so identity checks on type() can
+    # stand in for isinstance()
+    Import, ImportFrom, If, Try, With = ast.Import, ast.ImportFrom, ast.If, ast.Try, ast.With
+    For, While, Match = ast.For, ast.While, ast.Match
+    TryStar = getattr(ast, "TryStar", Try)  # "except*" blocks, Python 3.11+
+
+    stack: list[ast.stmt] = list(tree.body)
+    while stack:
+        node = stack.pop()
+        node_type = type(node)
+        if node_type is Import:
             names = (alias.name for alias in node.names)
-        elif isinstance(node, ast.ImportFrom) and node.module:
+        elif node_type is ImportFrom:
+            if not node.module or node.level:
+                continue
             names = (node.module,)
+        elif node_type is If or node_type is For or node_type is While:
+            stack.extend(node.body)
+            stack.extend(node.orelse)
+            continue
+        elif node_type is Try or node_type is TryStar:
+            stack.extend(node.body)
+            for handler in node.handlers:
+                stack.extend(handler.body)
+            stack.extend(node.orelse)
+            stack.extend(node.finalbody)
+            continue
+        elif node_type is With:
+            stack.extend(node.body)
+            continue
+        elif node_type is Match:
+            for case in node.cases:
+                stack.extend(case.body)
+            continue
         else:
             continue
 
         for full_name in names:
-            name = full_name.partition(".")[0]
-            if name in stdlib:
-                continue
+            import_names.add(full_name.partition(".")[0])
+
+    return import_names
+
+
+def load_import_names(source: str, cache_dir: Path = AST_CACHE_DIR) -> set[str]:
+    """
+    Return the imported module names for the given source, reusing a cached
+    result keyed by the source hash and Python version when available.
+    """
+    py_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    key = f"{source_hash}-py{py_version}-v{AST_CACHE_VERSION}"
+    cache_path = cache_dir / f"{key}.json"
+
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        pass
+    else:
+        logger.debug(f"Loaded cached imports: {str(cache_path)!r}")
+        try:
+            # Mark the entry as used so prune_import_cache keeps it
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return set(cached)
+
+    import_names = extract_import_names(source)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(sorted(import_names)), encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"Failed to write import cache {str(cache_path)!r}: {e}")
+
+    return import_names
+
+
+def prune_import_cache(cache_dir: Path, used_since: float) -> None:
+    """Delete cached import results that were not read or written since the given time."""
+    # Allow for filesystems with coarse (e.g. 2 second) mtime resolution
+    cutoff = used_since - 2
+    try:
+        with os.scandir(cache_dir) as entries:
+            stale = [e for e in entries if e.name.endswith(".json") and e.stat().st_mtime < cutoff]
+    except FileNotFoundError:
+        return
+
+    for f in stale:
+        try:
+            os.unlink(f.path)
+            logger.debug(f"Deleted stale import cache: {f.name}")
+        except OSError as e:
+            logger.error(f"Failed to delete {f.name}: {e}")
+
+
+def read_source(file_path: str | Path) -> str:
+    """
+    Read a source file as UTF-8 with "\n" newlines, dropping any BOM, using a single
+    open, fstat and sized read.
+    """
+    try:
+        fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except FileNotFoundError:
+        raise FileNotFoundError(f"File not found: {file_path}") from None
+
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, st.st_size, os.POSIX_FADV_SEQUENTIAL)
+
+        chunks = [os.read(fd, st.st_size)]
+        # Keep reading in case the file grew or the read came back short
+        while chunk := os.read(fd, 65536):
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+    data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    # Translate newlines like text-mode reads do, so CRLF files match LF ones
+    return data.decode("utf-8-sig").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def find_third_party_imports(
+        file_path: str | Path,
+        resolver: Mapping[str, str],
+        seen_names: set[str],
+        out: set[str],
+        stdlib: frozenset[str] = STDLIB_MODULES
+) -> None:
+    """
+    Add PyPI distribution names for top-level third-party imports to out
+    using installed package metadata.
+
+    The resolver maps import names to distribution names where they differ;
+    it is built once by the caller, since building the metadata mapping walks
+    every installed distribution.
+
+    Names already in seen_names were handled while scanning an earlier file
+    and are skipped; newly handled names are added to it.
+    """
+    source = read_source(file_path)
+
+    for name in load_import_names(source):
+        if name in seen_names:
+            continue
+        seen_names.add(name)
 
-            logger.debug(f"Found non-stdlib import: {name}")
-            third_party.add(resolve_distribution(name, import_to_dist))
+        if name in stdlib:
+            continue
 
-    return third_party
+        logger.debug(f"Found non-stdlib import: {name}")
+        dist_name = resolver.get(name, name)
+        if dist_name != name:
+            logger.debug(f"Resolved {name} to {dist_name}")
+        out.add(dist_name)
 
 
 def write_requirements(non_std_modules: set[str], output_path: str | Path = "requirements.txt") -> None:
@@ -77,54 +246,96 @@ def write_requirements(non_std_modules: set[str], output_path: str | Path = "req
     """
     path = Path(output_path)
     if not non_std_modules:
-        logger.warning(f"No non-standard modules detected; {json.dumps(str(path))} not generated")
+        logger.warning(f"No non-standard modules detected; {str(path)!r} not generated")
         return
 
-    with path.open("w", encoding="utf-8", newline="\n") as f:
-        for module in sorted(non_std_modules):
-            f.write(f"{module}\n")
+    path.write_text("\n".join(sorted(non_std_modules)) + "\n", encoding="utf-8", newline="\n")
 
-    logger.info(f"Generated requirements file: {json.dumps(str(path))}")
+    logger.info(f"Generated requirements file: {str(path)!r}")
 
 
 def main():
     """Scan Python files and generate requirements.txt for third-party imports."""
 
     working_dir = os.getcwd()
-    logger.debug(f"Working directory: {json.dumps(str(working_dir))}")
+    logger.debug(f"Working directory: {working_dir!r}")
 
-    current_file = Path(__file__).name
+    excluded_files = {Path(__file__).name, "generate_requirements.txt.pyw"}
     logger.info("Scanning current directory for Python files...")
-    python_files = [
-        Path(f) for f in os.listdir(".")
-        if f.endswith((".py", ".pyw")) and f != current_file and f != "generate_requirements.txt.pyw"
-    ]
+    python_files = []
+    seen_files = set()
+    with os.scandir(".") as entries:
+        for e in entries:
+            if not e.name.endswith((".py", ".pyw")) or e.name in excluded_files or not e.is_file():
+                continue
+
+            # Skip symlinks and hardlinks to a file that was already found.
+            # DirEntry.stat() leaves st_ino at 0 on Windows, so stat again there
+            st = e.stat()
+            if not st.st_ino:
+                st = os.stat(e.path)
+            file_id = (st.st_dev, st.st_ino)
+            if file_id in seen_files:
+                logger.debug(f"Skipping duplicate of an already found file: {e.name!r}")
+                continue
+            seen_files.add(file_id)
+            python_files.append(Path(e.name))
 
     if not python_files:
         logger.info("No Python files found in current directory.")
         return
 
     logger.info(f"Found {len(python_files)} Python files:"
-                f" {', '.join([json.dumps(str(f)) for f in python_files])}")
+                f" {', '.join([repr(str(f)) for f in python_files])}")
+
+    # Deferred until there is something to scan
+    import importlib.metadata
+    from concurrent.futures import ThreadPoolExecutor
 
-    non_std_modules = set()
-    for f in python_files:
-        logger.info(f"Scanning: {json.dumps(str(f))}...")
-        non_std_modules.update(find_third_party_imports(f))
+    import_to_dist = importlib.metadata.packages_distributions()
+    resolver = {name: dists[0] for name, dists in import_to_dist.items() if dists and dists[0] != name}
+
+    # File reads overlap across threads, so scan files concurrently
+    max_workers = min(32, (os.cpu_count() or 1) * 4, len(python_files))
+    non_std_modules: set[str] = set()
+    seen_names: set[str] = set()
+    scan_started = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda f: find_third_party_imports(f, resolver, seen_names, non_std_modules), python_files
+        )
+        for f, _ in zip(python_files, results):
+            logger.info(f"Scanned: {str(f)!r}")
     logger.info("Done scanning Python files.")
 
+    # Entries for edited or removed files, or an older cache version, are no longer needed
+    prune_import_cache(AST_CACHE_DIR, scan_started)
+
     if len(non_std_modules) == 0:
         logger.debug("No non-standard modules detected.")
         if os.path.exists("requirements.txt"):
             os.remove("requirements.txt")
-            logger.info(f"Deleted existing requirements file: {json.dumps('requirements.txt')}")
+            logger.info("Deleted existing requirements file: 'requirements.txt'")
         return
 
-    logger.debug(f"All detected non-standard modules: {json.dumps(list(non_std_modules))}")
+    logger.debug(f"All detected non-standard modules: {sorted(non_std_modules)}")
 
     write_requirements(non_std_modules)
 
 
+DURATION_UNITS: tuple[tuple[str, int], ...] = (
+    ("y", 365 * 24 * 60 * 60 * 1_000_000_000),
+    ("mo", 30 * 24 * 60 * 60 * 1_000_000_000),
+    ("d", 24 * 60 * 60 * 1_000_000_000),
+    ("h", 60 * 60 * 1_000_000_000),
+    ("m", 60 * 1_000_000_000),
+    ("s", 1_000_000_000),
+    ("ms", 1_000_000),
+    ("us", 1_000),
+    ("ns", 1),
+)
+
+
 def format_duration_long(duration_seconds: float) -> str:
     """
     Format duration in a human-friendly way, showing only the two largest non-zero units.
@@ -132,24 +343,13 @@ def format_duration_long(duration_seconds: float) -> str:
     For durations >= 1m, do not show milliseconds.
     """
     ns = int(duration_seconds * 1_000_000_000)
-    units = [
-        ("y", 365 * 24 * 60 * 60 * 1_000_000_000),
-        ("mo", 30 * 24 * 60 * 60 * 1_000_000_000),
-        ("d", 24 * 60 * 60 * 1_000_000_000),
-        ("h", 60 * 60 * 1_000_000_000),
-        ("m", 60 * 1_000_000_000),
-        ("s", 1_000_000_000),
-        ("ms", 1_000_000),
-        ("us", 1_000),
-        ("ns", 1),
-    ]
     parts = []
-    for name, factor in units:
-        value, ns = divmod(ns, factor)
-        if value:
+    for name, factor in DURATION_UNITS:
+        if ns >= factor:
+            value, ns = divmod(ns, factor)
             parts.append(f"{value}{name}")
-        if len(parts) == 2:
-            break
+            if len(parts) == 2:
+                break
     if not parts:
         return "0s"
     return "".join(parts)
@@ -160,18 +360,17 @@ def enforce_max_log_count(dir_path: Path | str, max_count: int | None, script_na
     if max_count is None or max_count <= 0:
         return
 
-    dir_path = Path(dir_path)
-
-    # Get all logs for this script, sorted by name (which is our timestamp)
-    # Newest will be at the end of the list
-    files = sorted([f for f in dir_path.glob(f"*{script_name}*.log") if f.is_file()])
+    # Get all logs for this script; names start with a timestamp, so the
+    # smallest names are the oldest
+    with os.scandir(dir_path) as entries:
+        files = [e for e in entries if e.name.endswith(".log") and script_name in e.name and e.is_file()]
 
-    # If there is more than the limit, calculate how many to delete
+    # If there is more than the limit, delete only the oldest surplus
     if len(files) > max_count:
-        to_delete = files[:-max_count]  # Everything except the last N files
+        to_delete = heapq.nsmallest(len(files) - max_count, files, key=lambda e: e.name)
         for f in to_delete:
             try:
-                f.unlink()
+                os.unlink(f.path)
                 logger.debug(f"Deleted old log: {f.name}")
             except OSError as e:
                 logger.error(f"Failed to delete {f.name}: {e}")
@@ -186,7 +385,7 @@ def setup_logging(
         file_logging_level: int = logging.DEBUG,
         message_format: str = "%(asctime)s.%(msecs)03d %(levelname)s [%(funcName)s]: %(message)s",
         date_format: str = "%Y-%m-%d %H:%M:%S"
-) -> None:
+) -> logging.FileHandler:
     """
     Set up logging for a script.
 
@@ -198,8 +397,14 @@ def setup_logging(
     file_logging_level (int, optional): The logging level for file output. Defaults to logging.DEBUG.
     message_format (str, optional): The format string for log messages. Defaults to "%(asctime)s.%(msecs)03d %(levelname)s [%(funcName)s]: %(message)s".
     date_format (str, optional): The format string for log timestamps. Defaults to "%Y-%m-%d %H:%M:%S".
+
+    Returns:
+    logging.FileHandler: The file handler behind the buffering handler. It is not attached to the logger
+    directly, so close it after closing the logger's handlers.
     """
 
+    from logging.handlers import MemoryHandler  # Pulls in socket, pickle and threading
+
     file_path = Path(file_path)
     dir_path = file_path.parent
     dir_path.mkdir(parents=True, exist_ok=True)
@@ -209,11 +414,17 @@ def setup_logging(
 
     formatter = logging.Formatter(message_format, datefmt=date_format)
 
-    # File Handler
+    # File Handler, buffered so records are written in batches
     file_handler = logging.FileHandler(file_path, encoding="utf-8")
     file_handler.setLevel(file_logging_level)
     file_handler.setFormatter(formatter)
-    logger_obj.addHandler(file_handler)
+    memory_handler = MemoryHandler(
+        capacity=2048,
+        flushLevel=logging.ERROR,
+        target=file_handler
+    )
+    memory_handler.setLevel(file_logging_level)
+    logger_obj.addHandler(memory_handler)
 
     # Console Handler
     console_handler = logging.StreamHandler(sys.stdout)
@@ -224,13 +435,20 @@ def setup_logging(
     if max_log_files is not None:
         enforce_max_log_count(dir_path, max_log_files, script_name)
 
+    return file_handler
+
 
 def bootstrap():
     """
     Handles environment setup, configuration loading,
     and logging before executing the main script logic.
     """
+    # Local so importing this module stays light; a run always needs them
+    import socket
+    from datetime import datetime
+
     exit_code = 0
+    file_handler = None
     try:
         script_path = Path(__file__)
         script_name = script_path.stem
@@ -246,7 +464,7 @@ def bootstrap():
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         log_path = logs_folder / f"{timestamp}__{script_name}__{pc_name}.log"
 
-        setup_logging(
+        file_handler = setup_logging(
             logger_obj=logger,
             file_path=log_path,
             script_name=script_name,
@@ -257,7 +475,7 @@ def bootstrap():
         )
 
         start_ns = time.perf_counter_ns()
-        logger.info(f"Script: {json.dumps(script_name)} | Version: {__version__} | Host: {json.dumps(pc_name)}")
+        logger.info(f"Script: {script_name!r} | Version: {__version__} | Host: {pc_name!r}")
 
         main()
 
@@ -275,6 +493,9 @@ def bootstrap():
         for handler in logger.handlers[:]:
             handler.close()
             logger.removeHandler(handler)
+        # Closing the MemoryHandler flushes into its target but doesn't close it
+        if file_handler is not None:
+            file_handler.close()
 
     input("Press Enter to exit...")
 